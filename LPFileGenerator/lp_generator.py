@@ -3,6 +3,11 @@ Description:
 This programme is used to genetate a LP file with given paramenters.
 
 """
+import sys
+import argparse
+import subprocess
+
+WRITE_BUFFER_SIZE = 1024 * 1024
 
 class Generator:
     """
@@ -17,140 +22,181 @@ class Generator:
         self.transits = transits
         self.destinations = destinations
         self.file_name = file_name
-        self.file_string = ""
+
+        # Only the decimal digits of every index are formatted once. The variables are concatenated from them
+        # when they are written, so that memory does not grow with the size of the LP file.
+        self.source_ids = [b"%d" % i for i in range(1, self.sources + 1)]
+        self.transit_ids = [b"%d" % k for k in range(1, self.transits + 1)]
+        self.destination_ids = [b"%d" % j for j in range(1, self.destinations + 1)]
+
+
+    @classmethod
+    def from_args(cls, args):
+        """
+        Create a generator from command line arguments instead of interactive prompts
+        """
+        parser = argparse.ArgumentParser(description="Generate a LP file with given numbers of nodes.")
+        parser.add_argument("-s", "--sources", type=int, required=True, help="number of source nodes")
+        parser.add_argument("-t", "--transits", type=int, required=True, help="number of transit nodes")
+        parser.add_argument("-d", "--destinations", type=int, required=True, help="number of destination nodes")
+        parser.add_argument("-o", "--output", default="lp.lp", help="name of the generated LP file")
+        parsed_args = parser.parse_args(args)
+
+        return cls(parsed_args.sources, parsed_args.transits, parsed_args.destinations, parsed_args.output)
 
 
     def generate_objective_func(self):
         """
         Generate the objective function
         """
-        self.file_string += "Minimize\n"
-        self.file_string += "r\n\n"
+        yield b"Minimize\n"
+        yield b"r\n\n"
 
 
     def generate_subject_to_constraints(self):
         """
         Generate subject-to constraints which include demand constraints, capacity constraints.
         """ 
-        self.file_string += "Subject to\n"
+        yield b"Subject to\n"
+
+        # Every variable is the prefix followed by the decimal digits of i, k and j,
+        # so each constraint concatenates the cached digits rather than formatting its variables.
+        transit_ids = self.transit_ids
+        destination_ids = self.destination_ids
+        x_sources = [b"x" + si for si in self.source_ids]
+        u_sources = [b"u" + si for si in self.source_ids]
 
         # Fill in demand constraints
         for i in range(1, self.sources + 1):
+            x_i = x_sources[i - 1]
             for j in range(1, self.destinations + 1):
-                equation = ""
-                for k in range(1, self.transits + 1):
-                    equation += "x{0}{1}{2}".format(i, k, j)
-                    if k != self.transits:
-                        equation += " + "
-                    else:
-                        equation += " = {}\n".format(i + j)
-                        self.file_string += equation
+                sj = destination_ids[j - 1]
+                yield b" + ".join([x_i + sk + sj for sk in transit_ids])
+                yield b" = %d\n" % (i + j)
 
         # Fill in capacity constraints (source -> transit)
-        self.file_string += "\n"
+        yield b"\n"
         
         for i in range(1, self.sources + 1):
+            x_i = x_sources[i - 1]
+            capacity_i = b" - c%d" % i
             for k in range(1, self.transits + 1):
-                equation = ""
-                for j in range(1, self.destinations + 1):
-                    equation += "x{0}{1}{2}".format(i, k, j)
-                    if j != self.destinations:
-                        equation += " + "
-                    else:
-                        equation += " - c{}{} <= 0\n".format(i, k)
-                        self.file_string += equation
+                x_ik = x_i + transit_ids[k - 1]
+                yield b" + ".join([x_ik + sj for sj in destination_ids])
+                yield capacity_i + b"%d <= 0\n" % k
 
         # Fill in capacity constraints (transit -> destination)
-        self.file_string += "\n"
+        yield b"\n"
 
         for j in range(1, self.destinations + 1):
+            sj = destination_ids[j - 1]
             for k in range(1, self.transits + 1):
-                equation = ""
-                for i in range(1, self.sources + 1):
-                    equation += "x{0}{1}{2}".format(i, k, j)
-                    if i != self.sources:
-                        equation += " + "
-                    else:
-                        equation += " - d{}{} <= 0\n".format(k, j)
-                        self.file_string += equation
+                skj = transit_ids[k - 1] + sj
+                yield b" + ".join([x_i + skj for x_i in x_sources])
+                yield b" - d%d" % k + sj + b" <= 0\n"
 
         # Fill in split paths constraints
-        self.file_string += "\n"
+        yield b"\n"
         
         for i in range(1, self.sources + 1):
+            u_i = u_sources[i - 1]
             for j in range(1, self.destinations + 1):
-                equation = ""
-                for k in range(1, self.transits + 1):
-                    equation += "u{0}{1}{2}".format(i, k, j)
-                    if k != self.transits:
-                        equation += " + "
-                    else:
-                        equation += " = 2\n"
-                        self.file_string += equation
+                sj = destination_ids[j - 1]
+                yield b" + ".join([u_i + sk + sj for sk in transit_ids])
+                yield b" = 2\n"
 
         # Equal split flow constraints
-        self.file_string += "\n"
+        yield b"\n"
+
+        # The coefficient 0.5 * (i + j) is either "N.0" or "N.5", so format all of them once, indexed by i + j
+        coefficients = [b" - %d.%d " % (n // 2, 5 * (n % 2)) for n in range(self.sources + self.destinations + 1)]
 
         for i in range(1, self.sources + 1):
+            x_i = x_sources[i - 1]
+            u_i = u_sources[i - 1]
             for j in range(1, self.destinations + 1):
+                sj = destination_ids[j - 1]
+                coefficient = coefficients[i + j]
                 for k in range(1, self.transits + 1):
-                    equation = ""
-                    equation += "x{0}{1}{2} - {3} u{4}{5}{6} = 0\n".format(i, k, j, 0.5 * (i + j), i, k, j)
-                    self.file_string += equation
+                    skj = transit_ids[k - 1] + sj
+                    yield x_i + skj + coefficient + u_i + skj + b" = 0\n"
 
 
         # Transits balance load constraints
-        self.file_string += "\n"
+        yield b"\n"
 
         for k in range(1, self.transits + 1):
-            equation = ""
-            for i in range(1, self.sources + 1):
-                for j in range(1, self.destinations + 1):
-                    equation += "x{0}{1}{2}".format(i, k, j)
-                    if not (i == self.sources and j == self.destinations):
-                        equation += " + "
-            
-            equation += " - r <= 0\n"
-            self.file_string += equation
+            sk = transit_ids[k - 1]
+            terms = [x_ik + sj for x_ik in [x_i + sk for x_i in x_sources] for sj in destination_ids]
+            yield b" + ".join(terms)
+            yield b" - r <= 0\n"
 
 
     def generate_bounds(self):
         """
         Generate all bounds
         """
-        self.file_string += "\n"
-        self.file_string += "Bounds"
-        self.file_string += "\n"
+        yield b"\n"
+        yield b"Bounds"
+        yield b"\n"
 
         # xikj > = 0
-        for i in range(1, self.sources + 1):
-            for k in range(1, self.transits + 1):
-                for j in range(1, self.destinations + 1):
-                    equation = ""
-                    equation += "x{0}{1}{2} >= 0\n".format(i, k, j)
-                    self.file_string += equation
+        # One block per source node, so that the joined string stays small for large inputs
+        bounds = [sj + b" >= 0\n" for sj in self.destination_ids]
+        for si in self.source_ids:
+            x_i = b"x" + si
+            yield b"".join([x_ik + bound for x_ik in [x_i + sk for sk in self.transit_ids] for bound in bounds])
 
         # r >= 0
-        self.file_string += "r >= 0\n"
+        yield b"r >= 0\n"
 
     
     def generate_binary_bounds(self):
         """
         Generete all integer bounds
         """
-        self.file_string += "\n"
-        self.file_string += "Binary"
-        self.file_string += "\n"
+        yield b"\n"
+        yield b"Binary"
+        yield b"\n"
 
-        for i in range(1, self.sources + 1):
-            for k in range(1, self.transits + 1):
-                for j in range(1, self.destinations + 1):
-                    equation = ""
-                    equation += "u{0}{1}{2}\n".format(i, k, j)
-                    self.file_string += equation
+        lines = [sj + b"\n" for sj in self.destination_ids]
+        for si in self.source_ids:
+            u_i = b"u" + si
+            yield b"".join([u_ik + line for u_ik in [u_i + sk for sk in self.transit_ids] for line in lines])
 
-        self.file_string += "\n"
-        self.file_string += "End"
+        yield b"\n"
+        yield b"End"
+
+
+    def generate_lp(self):
+        """
+        Generate the whole LP piece by piece, so that callers can consume it without
+        keeping the entire content in memory
+        """
+        yield from self.generate_objective_func()
+        yield from self.generate_subject_to_constraints()
+        yield from self.generate_bounds()
+        yield from self.generate_binary_bounds()
+
+
+    def pipe_to(self, command):
+        """
+        Stream the LP into the standard input of the given command, e.g. a solver, without creating a file
+        """
+        # The command may exit without reading all of its input, e.g. when a solver rejects it,
+        # so a broken pipe only ends the writing and the exit status is still returned, like Popen.communicate()
+        with subprocess.Popen(command, stdin=subprocess.PIPE, bufsize=WRITE_BUFFER_SIZE) as process:
+            try:
+                process.stdin.writelines(self.generate_lp())
+            except BrokenPipeError:
+                pass
+
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+        return process.returncode
 
 
     def generate(self):
@@ -158,14 +204,11 @@ class Generator:
         Generate a lp file accroding to the numbers of of source nodes,
         transit nodes and destination nodes
         """
-        self.generate_objective_func()
-        self.generate_subject_to_constraints()
-        self.generate_bounds()
-        self.generate_binary_bounds()
-
-        file_object = open(self.file_name, "w")
-        file_object.write(self.file_string)
-        file_object.close()
+        # Write the equations straight into a large file buffer rather than keeping the whole LP in memory.
+        # The LP file is plain ASCII, so everything is generated as bytes and written in binary mode
+        # to skip the text encoding layer.
+        with open(self.file_name, "wb", buffering=WRITE_BUFFER_SIZE) as file_object:
+            file_object.writelines(self.generate_lp())
 
         print("{} has been created!".format(self.file_name))
 
@@ -174,6 +217,11 @@ def main():
     """
     Create a lp file generator and run it
     """
+    # Skip the prompts if the numbers are given on the command line
+    if len(sys.argv) > 1:
+        lp_generator = Generator.from_args(sys.argv[1:])
+        lp_generator.generate()
+        return
 
     source_count = input("How many source nodes do you need?: ")
     transit_count = input("How many transit nodes do you need?: ")
@@ -6,20 +6,44 @@ each instance runs as a separate process, and these processes communicate throug
 
 """
 import sys
+import re
+import argparse
+import struct
 import socket
 import selectors
-import threading
+import heapq
+import time
 import logging
 import random
 
-# For debug
-#logging.basicConfig(level=logging.DEBUG, format='(%(threadName)-9s) %(message)s',)
+# Routing tables and invalid entries are reported through the logger
+logger = logging.getLogger(__name__)
 
 INFINITE_METRIC = 16
 PERIODIC_UPDATE_TIMER_INTERVAL = 7
 TIMEOUT_TIMER_INTERVAL = PERIODIC_UPDATE_TIMER_INTERVAL * 6
 GARBAGE_COLLECTION_TIMER_INTERVAL = PERIODIC_UPDATE_TIMER_INTERVAL * 4
 
+# The maximum number of queued messages read from a socket per selector event
+RECEIVE_BATCH_SIZE = 8
+# The size of kernel buffers of sockets
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Formats of the fields in config files
+PORT_PATTERN = re.compile(r"\d+")
+OUTPUT_PATTERN = re.compile(r"(\d+)-(\d+)-(\d+)")
+
+# Wire formats in little endian
+# Header: command(1), version(1), sending router id(2)
+RIP_HEADER = struct.Struct("<BBH")
+# RIP entry: address family identifier(2), must be zero(2), IPv4 address(4), subnet mask(4), next hop(4), metric(4)
+RIP_ENTRY = struct.Struct("<HHIIII")
+# Offset of the metric within a RIP entry, its lowest byte comes first
+RIP_ENTRY_METRIC_OFFSET = 16
+# A response message carries 25 RIP entries at most, one of which is taken by the direct route to the neighbor
+MAX_RIP_ENTRIES = 25
+ROUTES_PER_MESSAGE = MAX_RIP_ENTRIES - 1
+
 class ResponseMessage:
     """
     This class defines the structure of a response message which is used for communicating with
@@ -30,7 +54,10 @@ class ResponseMessage:
         """
         This class defines the structure of a rip entry
         """
-        def __init__(self, route=None):
+        # Plenty of entries are created for every message, so avoid a per-instance __dict__
+        __slots__ = ("address_family_identifier", "dest_router_id", "next_hop", "metric")
+
+        def __init__(self, dest_router_id=0, next_hop=0, metric=0):
             """
             Initialise all the fields in rip entry
             Note: 1. Only AF_INET is supported.
@@ -38,11 +65,9 @@ class ResponseMessage:
                      the field of "ip_address" should be filled in router id
             """
             self.address_family_identifier = 2
-
-            if route != None:
-                self.dest_router_id = route.dest
-                self.next_hop = route.neighbor
-                self.metric = route.metric
+            self.dest_router_id = dest_router_id
+            self.next_hop = next_hop
+            self.metric = metric
 
 
         def __str__(self):
@@ -69,12 +94,11 @@ class ResponseMessage:
         self.rip_entries = []
 
 
-    def add_rip_entry(self, route):
+    def add_rip_entry_raw(self, dest_router_id, next_hop, metric):
         """
-        Generate a rip entry according to a routing table entry.
+        Generate a rip entry from its fields directly, without the need of a routing table entry.
         """
-        entry = self.RIPEntry(route)
-        self.rip_entries.append(entry)
+        self.rip_entries.append(self.RIPEntry(dest_router_id, next_hop, metric))
 
 
     def encode(self):
@@ -83,115 +107,74 @@ class ResponseMessage:
         """
         # According to RIP, Every message compirses one header and 1~25 RIP entries.
         # Header accounts for 4 bytes and every RIP entry accounts for 20 bytes
-        message = bytearray(4 + 20 * len(self.rip_entries))
-
         # Assemble header data
-        message[0] = self.command
-        message[1] = self.version
-
-        # We use 16 bits to store sending router id, so the id value is divided into 2 parts
-        message[2] = self.sending_router_id & 255
-        message[3] = (self.sending_router_id) >> 8 & 255
+        # We use 16 bits to store sending router id
+        parts = [RIP_HEADER.pack(self.command, self.version, self.sending_router_id)]
 
         # Assemble RIP entries
-        start_index = 4
-        for entry in self.rip_entries:
-            # Address family identifier field(2)
-            message[start_index] = entry.address_family_identifier & 255
-            message[start_index + 1] = 0
-
-            # must be zero (2)
-            message[start_index + 2] = 0
-            message[start_index + 3] = 0
-
-            # IPv4 address (4)
-            # In this programe, we use router id instead (16 bits)
-            message[start_index + 4] = entry.dest_router_id & 255
-            message[start_index + 5] = (entry.dest_router_id >> 8) & 255
-            message[start_index + 6] = 0
-            message[start_index + 7] = 0
-
-            # Subnet Mask (4)
-            message[start_index + 8] = 0
-            message[start_index + 9] = 0
-            message[start_index + 10] = 0
-            message[start_index + 11] = 0
-
-            # Next Hop (4)
-            # In this programe, we use router id instead (16 bits)
-            message[start_index + 12] = entry.next_hop & 255
-            message[start_index + 13] = (entry.dest_router_id >> 8) & 255
-            message[start_index + 14] = 0
-            message[start_index + 15] = 0
-
-            # Metric (4)
-            message[start_index + 16] = entry.metric & 255
-            message[start_index + 17] = 0
-            message[start_index + 18] = 0
-            message[start_index + 19] = 0
-
-            start_index += 20
-
-        return message
+        # In this programe, we use router id instead of IPv4 address and next hop
+        # Packing every entry separately and joining them once is faster than packing them into a zero-filled buffer.
+        # The result is still a bytearray, so that the metrics can be patched for every neighbor.
+        parts.extend([RIP_ENTRY.pack(entry.address_family_identifier, 0, entry.dest_router_id, 0, entry.next_hop, entry.metric)
+                      for entry in self.rip_entries])
+
+        return bytearray().join(parts)
     
 
     def decode(self, data):
         """
         Decode the message stream
         """
+        # Work on a memoryview so that unpacking does not copy the received data
+        data = memoryview(data)
+
         # Parse RIP response message header
-        self.command = data[0]
+        if len(data) < RIP_HEADER.size:
+            logger.warning("ResponseMessage:decode - message too short: %s bytes", len(data))
+            return False
+
+        self.command, self.version, self.sending_router_id = RIP_HEADER.unpack_from(data, 0)
         if self.command != 2:
-            print("ResponseMessage:decode - wrong command")
+            logger.warning("ResponseMessage:decode - wrong command: %s", self.command)
             return False
 
-        self.version = data[1]
         if self.version != 2:
-            print("ResponseMessage:decode - wrong version")
+            logger.warning("ResponseMessage:decode - wrong version: %s", self.version)
             return False
 
-        self.sending_router_id = data[2] + data[3] * 256
         if self.sending_router_id > 64000 or self.sending_router_id < 1:
-            print("ResponseMessage:decode - wrong sending router id")
+            logger.warning("ResponseMessage:decode - wrong sending router id: %s", self.sending_router_id)
             return False
 
         # Parse RIP entries
         # Header accounts for 4 bytes and every RIP entry accounts for 20 bytes
-        entry_number = (len(data) - 4) // 20
-        start_index = 4
-
-        for i in range(entry_number):
-            entry = self.RIPEntry()
-
-            # Address family identifier field(2)
-            entry.address_family_identifier = data[start_index]
-            if entry.address_family_identifier != 2:
-                print("ResponseMessage:decode - wrong AFI")
+        # Any trailing bytes which do not make up a whole entry are ignored
+        entry_number = (len(data) - RIP_HEADER.size) // RIP_ENTRY.size
+        entries_data = data[RIP_HEADER.size:RIP_HEADER.size + entry_number * RIP_ENTRY.size]
+
+        # Look up the names used for every entry only once
+        append = self.rip_entries.append
+        RIPEntry = self.RIPEntry
+
+        # In this programe, we use router id instead of IPv4 address and next hop
+        for address_family_identifier, _, dest_router_id, _, next_hop, metric in RIP_ENTRY.iter_unpack(entries_data):
+            if address_family_identifier != 2:
+                logger.warning("ResponseMessage:decode - wrong AFI: %s", address_family_identifier)
                 return False
 
-            # IPv4 address (4)
-            # In this programe, we use router id instead (16 bits)
-            entry.dest_router_id = data[start_index + 4] + data[start_index + 5] * 256
-            if entry.dest_router_id > 64000 or entry.dest_router_id < 1:
-                print("ResponseMessage:decode - wrong destination router id")
+            if dest_router_id > 64000 or dest_router_id < 1:
+                logger.warning("ResponseMessage:decode - wrong destination router id: %s", dest_router_id)
                 return False
 
-            # Next Hop (4)
-            # In this programe, we use router id instead (16 bits)
-            entry.next_hop = data[start_index + 12] + data[start_index + 13] * 256
-            if entry.next_hop > 64000 or entry.next_hop < 1:
-                print("ResponseMessage:decode - wrong next_hop")
+            if next_hop > 64000 or next_hop < 1:
+                logger.warning("ResponseMessage:decode - wrong next_hop: %s", next_hop)
                 return False
 
-            # Metric (4)
-            entry.metric = data[start_index + 16]
-            if entry.metric > INFINITE_METRIC or entry.next_hop < 1:
-                print("ResponseMessage:decode - wrong metric")
+            if metric > INFINITE_METRIC or next_hop < 1:
+                logger.warning("ResponseMessage:decode - wrong metric: %s", metric)
                 return False
 
-            self.rip_entries.append(entry)
-
-            start_index += 20
+            append(RIPEntry(dest_router_id, next_hop, metric))
 
         return True
 
@@ -227,8 +210,23 @@ class Connection:
         self.input_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.input_socket.bind((self.ip, self.input_port))
 
+        # Enlarge the receive buffer so that bursts of updates during convergence are not dropped by the kernel.
+        # Note: Linux silently caps the size at net.core.rmem_max, which may need to be raised as well.
+        # The socket is non-blocking, so that queued messages can be drained until it is empty.
+        self.input_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+        self.input_socket.setblocking(False)
+
+        # Every message is received into the same buffer and decoded straight away
+        self.receive_buffer = bytearray(1024)
+        self.receive_buffer_view = memoryview(self.receive_buffer)
+
         self.output_port = output_port
-        self.output_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # The output socket is shared by all the connections, so it cannot be connected to this neighbor.
+        # Build the destination address only once instead.
+        self.output_address = (self.ip, self.output_port)
+
+        # The entry of the direct connection is the same in every message, so encode it only once
+        self.direct_route_entry = RIP_ENTRY.pack(2, 0, neighbor_router_id, 0, neighbor_router_id, metric)
 
 
     def close(self):
@@ -236,70 +234,137 @@ class Connection:
         Close current socket
         """
         self.input_socket.close()
-        self.output_socket.close()
 
 
     def receive_routing_table_entries_from_neighbor(self):
         """
         Reveive messages from a neighbor
+        All the messages which are already queued on the socket are read in one go (up to RECEIVE_BATCH_SIZE),
+        so that a burst of updates does not need a selector round trip per message.
         """
-        data = self.input_socket.recvfrom(1024)[0]
-    
-        response_message = ResponseMessage()
-        result = response_message.decode(data)
-        if not result:
-            print("Decode message failed!")
-            return None
+        routes = []
+        append = routes.append
+        recv_into = self.input_socket.recv_into
+        receive_buffer_view = self.receive_buffer_view
+
+        for i in range(RECEIVE_BATCH_SIZE):
+            try:
+                size = recv_into(receive_buffer_view)
+            except BlockingIOError:
+                break
 
-        # For debugging
-        # print("received message (string):", str(response_message))
+            response_message = ResponseMessage()
+            result = response_message.decode(receive_buffer_view[:size])
+            if not result:
+                logger.warning("Decode message failed! (%s bytes from port %s)", size, self.input_port)
+                continue
 
-        # Conver response message into routing table entries
-        routes = []
-        for entry in response_message.rip_entries:
-            route = Route(response_message.sending_router_id, entry.dest_router_id, entry.next_hop, entry.metric)
-            routes.append(route)
+            # Conver response message into routing table entries
+            sending_router_id = response_message.sending_router_id
+            for entry in response_message.rip_entries:
+                append(Route(sending_router_id, entry.dest_router_id, entry.next_hop, entry.metric))
 
         return routes
 
 
-    def send_routing_table_entries_to_neighbor(self, routes):
+    def send_routing_table_entries_to_neighbor(self, output_socket, messages):
         """
-        Send messages to a neighbor
-        There is a limit of 25 RTEs to a Response; if there are more, send the current Response and start a new one. 
+        Send messages to a neighbor through the given output socket, which is shared by all the connections
+        The messages are encoded once for all the neighbors by the daemon, along with the offsets of the metrics
+        which need to be poisoned for each neighbor.
         """
-        message_count = len(routes) // 25
-        if len(routes) % 25 != 0:
-            message_count += 1
-
-        for i in range(message_count):
-            message = ResponseMessage(self.sending_router_id)
-
-            start_index = i * 25
-            for index in range(start_index, len(routes)):
-                route = routes[index]
-                sending_route = Route(route.src, route.dest, route.neighbor, route.metric)
-            
-                # Do split horizon with poisoned reverse process except that the destination is its neighbor
-                if route.neighbor == self.neighbor_router_id and route.dest != self.neighbor_router_id:
-                    sending_route.metric = INFINITE_METRIC
-        
-                message.add_rip_entry(sending_route)
+        sendto = output_socket.sendto
+        output_address = self.output_address
+        direct_route_entry = self.direct_route_entry
+        neighbor_router_id = self.neighbor_router_id
 
+        for message_data, poisoned_offsets in messages:
             # Fix bug
             # Add an extra route data which represents the direct connection
             # This data is useful in this situation:
             # When the metric to one of destinations is lower than the route via its current neighbor( the owner of current input port)
             # it will lose information when current route becomes invalid and have to choose its current neighbor insteam.
-            sending_route = Route(self.sending_router_id, self.neighbor_router_id, self.neighbor_router_id, self.metric)
-            message.add_rip_entry(sending_route)
-    
-            data = message.encode()
+            data = message_data + direct_route_entry
 
-            # For debugging
-            # print("sent message (string):", str(message))
+            # Do split horizon with poisoned reverse process except that the destination is its neighbor
+            for offset in poisoned_offsets.get(neighbor_router_id, ()):
+                data[offset] = INFINITE_METRIC
 
-            self.output_socket.sendto(data, 0, (self.ip, self.output_port))
+            sendto(data, output_address)
+
+
+class Timer:
+    """
+    This class defines a one-shot timer which is scheduled on a timer queue
+    """
+    def __init__(self, deadline, callback, args):
+        """
+        Initialise a timer which expires at the given deadline (in time.monotonic() seconds)
+        """
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+
+    def cancel(self):
+        """
+        Cancel the timer. It stays in the queue until its deadline, but will not fire.
+        """
+        self.cancelled = True
+
+
+    def __lt__(self, other):
+        """
+        Timers are ordered by their deadlines in the queue
+        """
+        return self.deadline < other.deadline
+
+
+class TimerQueue:
+    """
+    This class implements all the timers of a rip daemon with a single heap ordered by deadline.
+    The timers are run by the daemon's own event loop, so no thread is needed per timer.
+    """
+    def __init__(self):
+        """
+        Initialise an empty timer queue
+        """
+        self.timers = []
+
+
+    def add_timer(self, interval, callback, args=()):
+        """
+        Schedule callback(*args) after the given interval (in seconds) and return the timer
+        """
+        timer = Timer(time.monotonic() + interval, callback, args)
+        heapq.heappush(self.timers, timer)
+        return timer
+
+
+    def get_timeout(self):
+        """
+        Get the time until the next timer expires, or None if there is no timer
+        """
+        # Drop the cancelled timers at the head, so that they do not wake up the event loop
+        while len(self.timers) != 0 and self.timers[0].cancelled:
+            heapq.heappop(self.timers)
+
+        if len(self.timers) == 0:
+            return None
+
+        return max(0, self.timers[0].deadline - time.monotonic())
+
+
+    def run_expired_timers(self):
+        """
+        Run the callbacks of all the expired timers
+        """
+        now = time.monotonic()
+        while len(self.timers) != 0 and self.timers[0].deadline <= now:
+            timer = heapq.heappop(self.timers)
+            if not timer.cancelled:
+                timer.callback(*timer.args)
 
 
 class Route:
@@ -318,23 +383,31 @@ class Route:
         self.timeout_timer = None
 
 
-    def activate_timeout_timer(self, callback):
+    def activate_timeout_timer(self, timer_queue, callback):
         """
         Activate timer for next timeout notification
         """
-        if self.timeout_timer != None and self.timeout_timer.is_alive():
+        if self.timeout_timer != None:
             self.timeout_timer.cancel()
     
         self.timeout_callback = callback
-        self.timeout_timer = threading.Timer(TIMEOUT_TIMER_INTERVAL, self.trigger_timeout)
-        self.timeout_timer.start()
+        self.timeout_timer = timer_queue.add_timer(TIMEOUT_TIMER_INTERVAL, self.trigger_timeout)
+
+
+    def deactivate_timeout_timer(self):
+        """
+        Stop the timeout timer, e.g. when the route is removed from the routing table
+        """
+        if self.timeout_timer != None:
+            self.timeout_timer.cancel()
+            self.timeout_timer = None
 
 
     def trigger_timeout(self):
         """
         This function indicates that current path is invalid and need to notify host to trigger a garbage collection process
         """
-        self.timeout_callback(self.neighbor, self.dest)
+        self.timeout_callback(self)
 
 
     def __str__(self):
@@ -348,14 +421,22 @@ class RIPDaemon:
     """
     This class is to implement a daemon which complys to a simplified RIP
     """
-    def __init__(self, file_name):
+    def __init__(self, file_name, verbose=False):
         """
         Initialise a rip daemon
+        If verbose is set, the routing table is also printed after every garbage collection.
         """
-        self.garbage_collection_timers = []
-        self.triggered_update_timers = []
+        self.verbose = verbose
+
+        # Garbage collection timers indexed by destination, as there is at most one route to every destination
+        self.garbage_collection_timers = {}
+        # At most one triggered update is pending at a time
+        self.triggered_update_timer = None
         self.periodic_update_timer = None
-        self.lock = threading.Lock()
+
+        # All the timers run on the event loop in activate(), so the callbacks never run concurrently
+        # with the processing of received messages.
+        self.timer_queue = TimerQueue()
 
         # Parse configuration file to extract router id, input ports and outputs
         (result, self.id, input_ports, self.outputs) = self.load_config_file(file_name)
@@ -363,15 +444,32 @@ class RIPDaemon:
             print("Fail to parse config file!")
             exit(1)
 
+        # Index neighbors and the metrics to them, which are looked up for every received entry
+        self.neighbors = set()
+        self.metrics_to_neighbors = {}
+        for output_port, metric, neightbor in self.outputs:
+            self.neighbors.add(neightbor)
+            self.metrics_to_neighbors[neightbor] = metric
+
         # Initialise all the valid routes
         # At first the valid routes only the routes to its neighbors
-        self.routes = []
+        # There is at most one route to every destination, so the routing table is a dict indexed by destination.
+        # It keeps the order in which the routes were added, which is the order they are sent in.
+        self.routes = {}
         for index in range(len(input_ports)):
             input_port = input_ports[index]
             output_port, metric, neightbor = self.outputs[index]
             route = Route(self.id, neightbor, neightbor, metric)
-            route.activate_timeout_timer(self.timeout_timer_callback)
-            self.routes.append(route)
+            route.activate_timeout_timer(self.timer_queue, self.timeout_timer_callback)
+            self.routes[neightbor] = route
+
+        # The encoded routing table, which is kept until any route is changed
+        self.response_messages = None
+
+        # All the messages are sent to 127.0.0.1 and only differ in the destination port,
+        # so a single output socket is shared by all the connections
+        self.output_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.output_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
 
         # Initialise all socket with neighbors
         self.connections = []
@@ -384,8 +482,9 @@ class RIPDaemon:
             self.connections.append(connection)
 
             # Register read event to current selector
-            # The reason why we do not register write event is to avoid infitite loop when activating this rip daemon.
-            self.selector.register(connection.input_socket, selectors.EVENT_READ)
+            # Sending never waits for the selector, UDP sockets are always ready to send these small messages.
+            # The connection is attached to the key, so that it can be found directly when the event occurs.
+            self.selector.register(connection.input_socket, selectors.EVENT_READ, connection)
 
         self.print_routing_table()
 
@@ -394,21 +493,20 @@ class RIPDaemon:
         """
         Clean useless resources
         """
-        # Unregister read and write event
+        # Unregister read event
         for connection in self.connections:
             self.selector.unregister(connection.input_socket)
-            self.selector.unregister(connection.output_socket)
             connection.close()
 
+        self.output_socket.close()
         self.selector.close()
         self.periodic_update_timer.cancel()
 
-        for i in range(len(self.garbage_collection_timers)):
-            timer = self.garbage_collection_timers[i][0]
+        for timer in self.garbage_collection_timers.values():
             timer.cancel()
 
-        for timer in self.triggered_update_timers:
-            timer.cancel()
+        if self.triggered_update_timer != None:
+            self.triggered_update_timer.cancel()
 
 
     def load_config_file(self, file_name):
@@ -426,12 +524,8 @@ class RIPDaemon:
             print(file_name, "does not exist!")
             return (False, route_id, input_ports, outputs)
         else:
-            lines = []
-            raw_lines = file.readlines()
-            for line in raw_lines:
-                # Filter empty lines and comments
-                if len(line.strip()) != 0 and not line.strip().startswith('#'):
-                    lines.append(line.strip())
+            # Filter empty lines and comments
+            lines = [line for line in [raw_line.strip() for raw_line in file] if line and not line.startswith('#')]
             file.close()
 
             if len(lines) < 3:
@@ -456,11 +550,12 @@ class RIPDaemon:
                 return (False, route_id, input_ports, outputs)
 
             for index in range(1, len(second_line_data)):
-                port = second_line_data[index].strip(',')
-                if not port.isdecimal() or int(port) < 1024 or int(port) > 64000:
+                match = PORT_PATTERN.fullmatch(second_line_data[index].strip(','))
+                port = int(match.group()) if match != None else 0
+                if port < 1024 or port > 64000:
                     print("Wrong port number!")
                     return (False, route_id, input_ports, outputs)
-                input_ports.append(int(port))
+                input_ports.append(port)
             
             # Make sure that each port number occurs at most once.
             input_ports_set = set(input_ports)
@@ -475,21 +570,27 @@ class RIPDaemon:
                 return (False, route_id, input_ports, outputs)
 
             for index in range(1, len(third_line_data)):
-                port, metric, neighbor_id = third_line_data[index].strip(',').split('-')
+                # Every output is in the format of "port-metric-neighbor id"
+                match = OUTPUT_PATTERN.fullmatch(third_line_data[index].strip(','))
+                if match == None:
+                    print("Wrong outputs format!")
+                    return (False, route_id, input_ports, outputs)
+
+                port, metric, neighbor_id = [int(field) for field in match.groups()]
 
-                if not port.isdecimal() or int(port) < 1024 or int(port) > 64000 or int(port) in input_ports:
+                if port < 1024 or port > 64000 or port in input_ports_set:
                     print("Wrong port number!")
                     return (False, route_id, input_ports, outputs)
 
-                if not metric.isdecimal() or int(metric) < 1 or int(metric) > 16:
+                if metric < 1 or metric > 16:
                     print("Wrong metric number!")
                     return (False, route_id, input_ports, outputs)
 
-                if not neighbor_id.isdecimal() or int(neighbor_id) < 1 or int(neighbor_id) > 64000:
+                if neighbor_id < 1 or neighbor_id > 64000:
                     print("Wrong neighbor router id!")
                     return (False, route_id, input_ports, outputs)
     
-                outputs.append((int(port), int(metric), int(neighbor_id)))
+                outputs.append((port, metric, neighbor_id))
 
             # Make sure that the input and output ports are one-to-one
             if len(input_ports) != len(outputs):
@@ -506,42 +607,28 @@ class RIPDaemon:
         self.activate_periodic_update_timer()
 
         while True:
-            # Waiting for I/O
-            events = self.selector.select()
+            # Waiting for I/O until the next timer expires
+            events = self.selector.select(self.timer_queue.get_timeout())
             for key, mask in events:
-                if mask & selectors.EVENT_READ != 0:
-                    for connection in self.connections:
-                        if connection.input_socket == key.fileobj:
-                            data = connection.receive_routing_table_entries_from_neighbor()
-
-                            self.lock.acquire()
-                            self.update_routing_table(data)
-                            self.lock.release()
-    
-                if mask & selectors.EVENT_WRITE != 0:
-                    for connection in self.connections:
-                        if connection.output_socket == key.fileobj:
-                            
-                            # Make sure the data not to be changed during the process of sending
-                            self.lock.acquire()
-                            connection.send_routing_table_entries_to_neighbor(self.routes)
-                            self.lock.release()
-
-                            # Unregister to avoid triggering infinate loop
-                            self.selector.unregister(connection.output_socket)
+                connection = key.data
+                data = connection.receive_routing_table_entries_from_neighbor()
+                self.update_routing_table(data)
 
-                            self.activate_periodic_update_timer()
+            self.timer_queue.run_expired_timers()
 
 
     def print_routing_table(self):
         """
         Print all the routing table entries on console
+        The table is only formatted if it is going to be logged.
         """
-        line = "\n---------------- Router {} Routing Table ----------------------\n".format(self.id)
-        for route in self.routes:
-            line += str(route)
-        line += "----------------------------------------------------------------\n"
-        print(line)
+        if not logger.isEnabledFor(logging.INFO):
+            return
+
+        lines = ["\n---------------- Router {} Routing Table ----------------------\n".format(self.id)]
+        lines.extend([str(route) for route in self.routes.values()])
+        lines.append("----------------------------------------------------------------\n")
+        logger.info("".join(lines))
 
 
     def is_valid_router_id(self, router_id):
@@ -558,52 +645,16 @@ class RIPDaemon:
         return metric >= 1 and metric <= INFINITE_METRIC
 
 
-    def is_neighbor(self, router_id):
-        """
-        Check whether the given router id is one of current router's neighbors
-        """
-        for connection in self.connections:
-            if connection.neighbor_router_id == router_id:
-                return True
-        return False
-
-
-    def get_metric_to_neighbor(self, neighbor_router_id):
-        """
-        Get the metric between sending router and its neighbor
-        This value is got from configuration file
-        """
-        for index in range(len(self.outputs)):
-            neightbor = self.outputs[index][2]
-            if neightbor == neighbor_router_id:
-                return self.outputs[index][1]
-        return None
-
-
-    def get_route_destinating_to(self, dest):
-        """
-        Get a specified route from current routing table
-        """
-        result = None
-        for route in self.routes:
-            if route.dest == dest:
-                result = route
-                break
-        
-        return result
-
-
     def reset_timeout_timer(self, neighbor_id, destination_id):
         """
         Reset timeout timer of current route
         """
-        for route in self.routes:
-            if route.neighbor == neighbor_id and route.dest == destination_id:
-                route.activate_timeout_timer(self.timeout_timer_callback)
+        route = self.routes.get(destination_id)
+        if route != None and route.neighbor == neighbor_id:
+            route.activate_timeout_timer(self.timer_queue, self.timeout_timer_callback)
 
-                # If the garbage-collection timer is running for this route, stop it
-                self.invalidate_garbage_collection_timer(neighbor_id, destination_id)
-                break
+            # If the garbage-collection timer is running for this route, stop it
+            self.invalidate_garbage_collection_timer(destination_id)
 
     
     def add_new_route(self, neighbor, destination, metric):
@@ -612,23 +663,21 @@ class RIPDaemon:
         Note: Should a new route to this network be established while the garbage-collection timer is running, 
         the new route will replace the one that is about to be deleted. In this case the garbage-collection timer must be cleared.
         """
-        self.invalidate_garbage_collection_timer(neighbor, destination)
+        self.invalidate_garbage_collection_timer(destination)
 
         new_route = Route(self.id, destination, neighbor, metric)
-        new_route.activate_timeout_timer(self.timeout_timer_callback)
-        self.routes.append(new_route)
+        new_route.activate_timeout_timer(self.timer_queue, self.timeout_timer_callback)
+        self.routes[destination] = new_route
+        self.response_messages = None
 
 
-    def invalidate_garbage_collection_timer(self, neighbor_id, destination_id):
+    def invalidate_garbage_collection_timer(self, destination_id):
         """
-        Invalid the given garbage collection timer
+        Invalid the garbage collection timer of the route to the given destination
         """
-        for i in range(len(self.garbage_collection_timers)):
-            timer, neighbor, destination = self.garbage_collection_timers[i]
-            if neighbor == neighbor_id and destination == destination_id:
-                timer.cancel()
-                self.garbage_collection_timers.remove((timer, neighbor, destination))
-                break
+        timer = self.garbage_collection_timers.pop(destination_id, None)
+        if timer != None:
+            timer.cancel()
 
 
     def update_routing_table(self, routes):
@@ -637,57 +686,64 @@ class RIPDaemon:
         If there is new route, add it.
         If the existed metric can be updated, update it.
         """
+        # Every entry is checked against the same tables, so look them up only once
+        neighbors = self.neighbors
+        metrics_to_neighbors = self.metrics_to_neighbors
+        get_route = self.routes.get
+        is_valid_router_id = self.is_valid_router_id
+        is_valid_metric = self.is_valid_metric
+        router_id = self.id
+
         for route in routes:
             # Firstly, we need to validate the correctness of entries
-            if not self.is_neighbor(route.src):
-                print("update_routing_table: The entry does not come from its directly-connected neighbor!")
-                print("wrong route:", str(route))
+            if route.src not in neighbors:
+                logger.warning("update_routing_table: The entry does not come from its directly-connected neighbor!\nwrong route: %s", route)
                 continue
 
-            if not self.is_valid_router_id(route.neighbor):
-                print("update_routing_table: wrong neighbor router id")
-                print("wrong route:", str(route))
+            if not is_valid_router_id(route.neighbor):
+                logger.warning("update_routing_table: wrong neighbor router id\nwrong route: %s", route)
                 continue
 
-            if not self.is_valid_router_id(route.dest):
-                print("update_routing_table: wrong destinated router id")
-                print("wrong route:", str(route))
+            if not is_valid_router_id(route.dest):
+                logger.warning("update_routing_table: wrong destinated router id\nwrong route: %s", route)
                 continue
 
-            if not self.is_valid_metric(route.metric):
-                print("update_routing_table: wrong metric value")
-                print("wrong route:", str(route))
+            if not is_valid_metric(route.metric):
+                logger.warning("update_routing_table: wrong metric value\nwrong route: %s", route)
                 continue
 
-            if route.dest == self.id:
-                if route.neighbor == self.id:
+            if route.dest == router_id:
+                if route.neighbor == router_id:
                     # If the message comes from its directly-connected neighbor and the destination is to itself, there will be two situations.
                     # 1. It is a periodic message from its neighbor and the neighor is alive
                     # 2. It is a periodic message from its neighbor and the neighor has just been rebooted after crashing
                     # What we need to do is to check whether current routing table contains an entry of this route.
                     # If current routing table contains this route, reactivate the timeout timer of this route.
                     # If current routing table does not contain this route, add this route into routing table.
-                    route_in_routing_table = self.get_route_destinating_to(route.src)
+                    route_in_routing_table = get_route(route.src)
                     if route_in_routing_table == None:
                          self.add_new_route(route.src, route.src, route.metric)
                     else:
                         if route_in_routing_table.neighbor == route.src:
                             if route.metric != INFINITE_METRIC:
-                                route_in_routing_table.metric = route.metric
+                                if route_in_routing_table.metric != route.metric:
+                                    route_in_routing_table.metric = route.metric
+                                    self.response_messages = None
                                 self.reset_timeout_timer(route.src, route.src)
                         else:
                             if route.metric < route_in_routing_table.metric:
                                 route_in_routing_table.neighbor = route.src
                                 route_in_routing_table.metric = route.metric
+                                self.response_messages = None
                                 self.reset_timeout_timer(route.src, route.dest)
                 continue
 
             # Calculate the total metric to destination via neighbor router
-            metric_to_neighbor = self.get_metric_to_neighbor(route.src)
+            metric_to_neighbor = metrics_to_neighbors[route.src]
             metric = min(metric_to_neighbor + route.metric, INFINITE_METRIC)
 
             # Secondly, process the valid RTEs one by one
-            route_in_routing_table = self.get_route_destinating_to(route.dest)
+            route_in_routing_table = get_route(route.dest)
             if route_in_routing_table == None:
                 # Add a new routing entry in routing table
                 if metric != INFINITE_METRIC:
@@ -700,10 +756,12 @@ class RIPDaemon:
                     # Check whether current metric is already 16. If so, ignore this route to avoid sending 
                     # multitime triggered updates
                     if route_in_routing_table.metric != INFINITE_METRIC:
-                        route_in_routing_table.metric = metric
+                        if route_in_routing_table.metric != metric:
+                            route_in_routing_table.metric = metric
+                            self.response_messages = None
                         if metric == INFINITE_METRIC:
                             self.activate_triggered_updates_timer()
-                            self.activate_garbage_collection_timer(route_in_routing_table.neighbor, route_in_routing_table.dest)
+                            self.activate_garbage_collection_timer(route_in_routing_table)
                         else:
                             self.reset_timeout_timer(route.src, route.dest)
                 else:
@@ -711,6 +769,7 @@ class RIPDaemon:
                     if metric < route_in_routing_table.metric:
                         route_in_routing_table.neighbor = route.src
                         route_in_routing_table.metric = metric
+                        self.response_messages = None
                         self.reset_timeout_timer(route.src, route.dest)
 
         self.print_routing_table()
@@ -725,53 +784,99 @@ class RIPDaemon:
         if self.periodic_update_timer != None:
             self.periodic_update_timer.cancel()
     
-        self.periodic_update_timer = threading.Timer(PERIODIC_UPDATE_TIMER_INTERVAL * random.uniform(0.8, 1.2), self.periodic_update_timer_callback)
-        self.periodic_update_timer.start()
+        self.periodic_update_timer = self.timer_queue.add_timer(PERIODIC_UPDATE_TIMER_INTERVAL * random.uniform(0.8, 1.2), self.periodic_update_timer_callback)
 
 
     def activate_triggered_updates_timer(self):
         """
         This function will initialise a timer to handle the process of triggered updates
         Accordind to RIP, it is better to set a timer with a random interval.
+        Every update carries the entire routing table, so the changes made while a triggered update is pending
+        are sent together with it instead of starting another one.
         """
-        timer = threading.Timer(random.uniform(0, 2), self.triggered_update_timer_callback)
-        self.triggered_update_timers.append(timer)
-        timer.start()
+        if self.triggered_update_timer != None:
+            return
 
+        self.triggered_update_timer = self.timer_queue.add_timer(random.uniform(0, 2), self.triggered_update_timer_callback)
 
-    def activate_garbage_collection_timer(self, neighbor, destination):
+
+    def activate_garbage_collection_timer(self, route):
         """
-        This function will initialise a timer to handle the process of garbage collection
+        This function will initialise a timer to handle the process of garbage collection of the given route
         """
         # Note that the deletion process is started only when the metric is first set to infinity. 
         # If the metric was already infinity, then a new deletion process is not started.
 
-        for timer, n, d in self.garbage_collection_timers:
-            if n == neighbor and d == destination:
-                return
+        if route.dest in self.garbage_collection_timers:
+            return
 
-        timer = threading.Timer(GARBAGE_COLLECTION_TIMER_INTERVAL, self.garbage_collection_timer_callback, [neighbor, destination])
-        self.garbage_collection_timers.append((timer, neighbor, destination))
-        timer.start()
+        timer = self.timer_queue.add_timer(GARBAGE_COLLECTION_TIMER_INTERVAL, self.garbage_collection_timer_callback, (route,))
+        self.garbage_collection_timers[route.dest] = timer
 
 
-    def register_write_event(self):
+    def send_routing_table_to_neighbors(self):
         """
         This function is triggered by periodic update timer or triggered update time.
-        After registration, current route will send entire routing table to its neighbors
+        Current route will send entire routing table to its neighbors
         """
+        # The table is only encoded again after it has changed
+        if self.response_messages == None:
+            self.response_messages = self.build_response_messages()
+
+        messages = self.response_messages
         for connection in self.connections:
-            self.selector.register(connection.output_socket, selectors.EVENT_WRITE)
+            connection.send_routing_table_entries_to_neighbor(self.output_socket, messages)
+
+
+    def build_response_messages(self):
+        """
+        Encode the entire routing table into response messages, which are shared by all the neighbors.
+        There is a limit of 25 RTEs to a Response; if there are more, start a new one.
+        Every neighbor gets the direct route entry appended to each message, so only 24 routes are put into one.
+        Each message comes with the offsets of the metrics to poison for every neighbor (split horizon with poisoned reverse),
+        so that only these bytes have to be patched per neighbor.
+        """
+        messages = []
+        routes = list(self.routes.values())
+        metric_offset = RIP_HEADER.size + RIP_ENTRY_METRIC_OFFSET
+
+        message_count = len(routes) // ROUTES_PER_MESSAGE
+        if len(routes) % ROUTES_PER_MESSAGE != 0:
+            message_count += 1
+
+        for i in range(message_count):
+            message = ResponseMessage(self.id)
+            poisoned_offsets = {}
+
+            # Every message only carries the next 24 routes at most, along with the direct route entry
+            start_index = i * ROUTES_PER_MESSAGE
+            for index in range(start_index, min(start_index + ROUTES_PER_MESSAGE, len(routes))):
+                route = routes[index]
+
+                # Routes learnt from a neighbor are poisoned for that neighbor, except the route to the neighbor itself
+                if route.dest != route.neighbor:
+                    offset = metric_offset + RIP_ENTRY.size * len(message.rip_entries)
+                    poisoned_offsets.setdefault(route.neighbor, []).append(offset)
+
+                message.add_rip_entry_raw(route.dest, route.neighbor, route.metric)
+
+            messages.append((message.encode(), poisoned_offsets))
+
+        return messages
 
 
     # Timer callbacks
     def periodic_update_timer_callback(self):
         """
-        Send periodic update messages to the neighbor router.
-        This function just register a write event into selector, not send messages immediately
-        This event will trigger while-loop to perform the operation of sending messages
+        Send periodic update messages to the neighbor router and start the next period.
+        The entire routing table is sent, so any pending triggered update would only repeat it and is cancelled.
         """
-        self.register_write_event()
+        if self.triggered_update_timer != None:
+            self.triggered_update_timer.cancel()
+            self.triggered_update_timer = None
+
+        self.send_routing_table_to_neighbors()
+        self.activate_periodic_update_timer()
 
 
     def triggered_update_timer_callback(self):
@@ -780,54 +885,70 @@ class RIPDaemon:
         This function is used to nofity neighbors that invalid routes occur。
         According to the specification of assignment, RIP response packets always include the entire routing table.
         """
-        self.register_write_event()
+        # This timer has expired, so the next change needs a new triggered update
+        self.triggered_update_timer = None
+        self.send_routing_table_to_neighbors()
 
 
-    def timeout_timer_callback(self, neighbor, destination):
+    def timeout_timer_callback(self, route):
         """
         This function is triggered by a connection timeout and launch the garbage collection timer.
+        The timer comes with the route itself, so it does not need to be looked up.
         """
-        self.lock.acquire()
-        for route in self.routes:
-            if route.neighbor == neighbor and route.dest == destination:
-                route.metric = INFINITE_METRIC
-        self.lock.release()
+        if self.routes.get(route.dest) is not route:
+            # The route has already gone, so there is nothing to notify or to collect
+            return
+
+        route.metric = INFINITE_METRIC
+        self.response_messages = None
 
         self.activate_triggered_updates_timer()
-        self.activate_garbage_collection_timer(neighbor, destination)
+        self.activate_garbage_collection_timer(route)
 
 
-    def garbage_collection_timer_callback(self, neighbor, destination):
+    def garbage_collection_timer_callback(self, route):
         """
         This function is triggered by a garbage collection timer.
         Remove the invalid route in routing table and self.connections
         """
-        valid_routes = []
+        # This timer has expired, so a new deletion process can be started for the same route later on
+        self.garbage_collection_timers.pop(route.dest, None)
 
         # Remove the invalid route form self.routes
-        self.lock.acquire()
+        # The timer comes with the route itself, which is removed by its destination if it is still in the routing table,
+        # so the rest of the routing table is not touched.
+        # All the timers run on the event loop, so nothing else can see the table while it is changed.
+        # Note: A route which has become valid again cancels this timer, the metric is checked as well to be safe.
+        if self.routes.get(route.dest) is route and route.metric == INFINITE_METRIC:
+            del self.routes[route.dest]
 
-        self.print_routing_table()
-        for route in self.routes:
-            if not (route.neighbor == neighbor and route.dest == destination):
-                valid_routes.append(route)
+            # A route which was poisoned by its neighbor still has a pending timeout, which must not fire for
+            # a route that no longer exists
+            route.deactivate_timeout_timer()
+            self.response_messages = None
 
-        self.routes = valid_routes
-        self.print_routing_table()
+            # Only the removed route is reported, rather than the entire table
+            logger.info("Garbage collection: removed the route to %s via %s", route.dest, route.neighbor)
 
-        self.lock.release()
+        # Dumping the whole table is only for debugging, and is compiled out with "python -O"
+        if __debug__ and self.verbose:
+            self.print_routing_table()
 
 
 def main():
     """
     Create a rip daemon and run it
     """
-    if len(sys.argv) != 2:
-        print("Need specify a config file!")
-        return
+    # A missing config file is reported on stderr with a nonzero exit status, so that supervisors can detect it
+    parser = argparse.ArgumentParser(description="Run a rip daemon with the given config file.")
+    parser.add_argument("config", help="config file of the router")
+    parser.add_argument("--verbose", action="store_true", help="also print the routing table after garbage collections")
+    args = parser.parse_args()
+
+    # The routing table is the output of the daemon, so log it on the console as before
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(message)s")
 
-    filename = sys.argv[1]
-    rip_daemon = RIPDaemon(filename)
+    rip_daemon = RIPDaemon(args.config, args.verbose)
     rip_daemon.activate()
 
 